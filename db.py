@@ -1,5 +1,6 @@
 import logging
 import sys
+from os import getenv
 from pathlib import Path
 
 import duckdb
@@ -7,10 +8,13 @@ import duckdb
 logger = logging.getLogger()
 data_dir = Path("data")
 query_path = Path(__file__).parent / "db.sql"
-wywrota_file_path = data_dir / "wywrota.csv"
-ultimate_guitar_file_path = data_dir / "ultimate_guitar.csv"
-spotify_file_path = data_dir / "spotify.csv"
+wywrota_file_path = data_dir / "wywrota.parquet"
+ultimate_guitar_file_path = data_dir / "ultimate_guitar.parquet"
+spotify_file_path = data_dir / "spotify.parquet"
 output_file_path = data_dir / "chords.parquet"
+# output is published for the web page so it is compressed as much as possible by default,
+# level 9 is ~20x faster to write for ~10% bigger file which is good enough for local experiments
+zstd_compression_level = int(getenv("PARQUET_ZSTD_LEVEL", "22"))
 
 
 def main() -> None:
@@ -29,7 +33,8 @@ def main() -> None:
             query=f"""
 COPY (
 {query_path.read_text()}
-) TO '{output_file_path.absolute().as_posix()}' WITH (format parquet, compression zstd, compression_level 22)
+) TO '{output_file_path.absolute().as_posix()}'
+WITH (format parquet, compression zstd, compression_level {zstd_compression_level}, row_group_size 262144)
             """.strip(),
             parameters={
                 "ultimate_guitar_file_path": ultimate_guitar_file_path.absolute().as_posix(),
@@ -4,57 +4,37 @@ all_chords as (
     trim(artist) as artist,
     trim(title) as title,
     url,
-    version,
-    rating,
-    votes,
+    version::int16 as version,
+    rating::float4 as rating,
+    votes::int32 as votes,
     difficulty,
     tonality_name,
     -- views,
     1 as src_order,
     1 as has_ug_tabs,
     0 as has_wywrota_tabs
-  FROM read_csv_auto($ultimate_guitar_file_path, columns := {
-    'artist': 'varchar',
-    'title': 'varchar',
-    'url': 'varchar',
-    'version': 'int16',
-    'rating': 'float4',
-    'votes': 'int32',
-    'difficulty': 'varchar',
-    'tonality_name': 'varchar',
-    'views': 'int32'
-  })
+  FROM read_parquet($ultimate_guitar_file_path)
   UNION ALL
   SELECT DISTINCT
     trim(artist) as artist,
     trim(title) as title,
     url,
-    version,
-    rating,
-    votes,
+    version::int16 as version,
+    rating::float4 as rating,
+    votes::int32 as votes,
     difficulty,
     tonality_name,
     -- views,
     0 as src_order,
     0 as has_ug_tabs,
     1 as has_wywrota_tabs
-  FROM read_csv($wywrota_file_path, columns := {
-    'artist': 'varchar',
-    'title': 'varchar',
-    'url': 'varchar',
-    'version': 'int16',
-    'rating': 'float4',
-    'votes': 'int32',
-    'difficulty': 'varchar',
-    'tonality_name': 'varchar',
-    'views': 'int32'
-  })
+  FROM read_parquet($wywrota_file_path)
 ),
 spotify_liked as (
   SELECT DISTINCT
     trim(artist) as artist,
     trim(title) as title
-  FROM read_csv_auto($spotify_file_path)
+  FROM read_parquet($spotify_file_path)
 ),
 songs_aggregated as (
   SELECT
@@ -64,7 +44,7 @@ songs_aggregated as (
       struct_pack(
         version := version,
         url := url,
-        rating := rating,
+        rating := rating::decimal(3, 2),
         votes := votes,
         difficulty := difficulty,
         tonality_name := tonality_name
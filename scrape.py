@@ -1,11 +1,16 @@
-import csv
 import dataclasses
 import logging
 import sys
+import types
+import typing
 from collections.abc import Callable, Generator
 from functools import partial
+from operator import attrgetter
 from pathlib import Path
 
+import pyarrow as pa
+import pyarrow.parquet as pq
+
 import scrapers.models
 import scrapers.spotify
 import scrapers.ultimate_guitar
@@ -13,22 +18,61 @@ import scrapers.wywrota
 
 logger = logging.getLogger()
 DATA_DIR = Path("data")
+ROWS_PER_BATCH = 10_000
+ARROW_TYPES = {
+    str: pa.string(),
+    int: pa.int64(),
+    float: pa.float64(),
+}
+
+
+def arrow_schema(model: type) -> pa.Schema:
+    """Create Arrow schema from dataclass fields. Optional fields (`X | None`) become nullable columns of type X."""
+    fields = []
+    for field in dataclasses.fields(model):
+        field_types = [t for t in typing.get_args(field.type) or (field.type,) if t is not types.NoneType]
+        fields.append(pa.field(field.name, ARROW_TYPES[field_types[0]]))
+    return pa.schema(fields)
+
+
+SONG_CHORDS_LINK_SCHEMA = arrow_schema(scrapers.models.SongChordsLink)
+SONG_SCHEMA = arrow_schema(scrapers.models.Song)
 
 
 def scrape_and_save(
     output_file: Path,
     scraper: Callable[..., Generator[dataclasses.dataclass, None, None]],
-    fieldnames: list[str],
+    schema: pa.Schema,
 ) -> int:
-    """Scrape data using provided scraper function and save it to a CSV file. Returns number of rows written."""
+    """Scrape data using provided scraper function and save it to a Parquet file. Returns number of rows written."""
 
     rows_written = 0
-    with output_file.open(mode="w", encoding="utf-8", newline="") as file:
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
-        writer.writeheader()
+    # slots dataclasses have no __dict__ and asdict makes a deep copy, attrgetter just reads the slots
+    get_row = attrgetter(*schema.names)
+    rows: list[tuple] = []
+
+    def write_batch(writer: pq.ParquetWriter) -> None:
+        if not rows:
+            return
+        columns = zip(*rows, strict=True)
+        arrays = [pa.array(column, type=field.type) for column, field in zip(columns, schema, strict=True)]
+        writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+        rows.clear()
+
+    # files are only ever read in full by db.py so column statistics would not be used for anything
+    with pq.ParquetWriter(
+        output_file,
+        schema=schema,
+        compression="zstd",
+        compression_level=9,
+        write_statistics=False,
+    ) as writer:
         for chord in scraper():
-            writer.writerow(dataclasses.asdict(chord))
+            rows.append(get_row(chord))
             rows_written += 1
+            if len(rows) >= ROWS_PER_BATCH:
+                write_batch(writer)
+        write_batch(writer)
     return rows_written
 
 
@@ -46,33 +90,33 @@ def main(args: list[str]) -> None:
 
     if scrape_ultimate_guitar:
         logger.info("Scraping started for Ultimate-Guitar")
-        ug_file_path = DATA_DIR / "ultimate_guitar.csv"
+        ug_file_path = DATA_DIR / "ultimate_guitar.parquet"
         ug_db_path = DATA_DIR / "ultimate_guitar.db"
         parser = partial(scrapers.ultimate_guitar.parse, db_path=ug_db_path)
         ug_rows_written = scrape_and_save(
             output_file=ug_file_path,
             scraper=parser,
-            fieldnames=[field.name for field in dataclasses.fields(scrapers.models.SongChordsLink)],
+            schema=SONG_CHORDS_LINK_SCHEMA,
         )
         logger.info("Scraping finished for Ultimate-Guitar. %d rows written to %s", ug_rows_written, ug_file_path)
 
     if scrape_wywrota:
         logger.info("Scraping started for Wywrota")
-        wywrota_file_path = DATA_DIR / "wywrota.csv"
+        wywrota_file_path = DATA_DIR / "wywrota.parquet"
         wywrota_rows_written = scrape_and_save(
             output_file=wywrota_file_path,
             scraper=scrapers.wywrota.parse,
-            fieldnames=[field.name for field in dataclasses.fields(scrapers.models.SongChordsLink)],
+            schema=SONG_CHORDS_LINK_SCHEMA,
         )
         logger.info("Scraping finished for Wywrota. %d rows written to %s", wywrota_rows_written, wywrota_file_path)
 
     if scrape_spotify:
         logger.info("Scraping started for Spotify")
-        spotify_file_path = DATA_DIR / "spotify.csv"
+        spotify_file_path = DATA_DIR / "spotify.parquet"
         spotify_rows_written = scrape_and_save(
             output_file=spotify_file_path,
             scraper=scrapers.spotify.extract,
-            fieldnames=[field.name for field in dataclasses.fields(scrapers.models.Song)],
+            schema=SONG_SCHEMA,
         )
         logger.info("Scraping finished for Spotify. %d rows written to %s", spotify_rows_written, spotify_file_path)
 
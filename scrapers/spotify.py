@@ -1,90 +1,192 @@
+import asyncio
 import logging
 import re
 from collections.abc import Generator
+from http import HTTPStatus
 from os import getenv
 
 import dotenv
+import httpx
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
 from tqdm import tqdm
 
 from scrapers import models
+from scrapers.utils import backoff_delay, http_get_async
 
 logger = logging.getLogger(__name__)
+SAVED_TRACKS_URL = "https://api.spotify.com/v1/me/tracks"
+# Spotify allows roughly 180 requests per minute so there is no point in going much higher
+MAX_CONCURRENT_REQUESTS = 10
+# parts of titles that are not part of the song name (remasters, versions, featured artists, etc.)
+TITLE_NOISE_PATTERNS = (
+    r" - \d{4} Remastered Version",
+    # " - 2011 Remastered" has to be removed whole, the generic remaster pattern below would leave " -ed" behind
+    r" - \d{4} Remastered",
+    r" - \d{4} Digital Remaster",
+    r" - \d{4} Remix",
+    r" - \d{4} Version",
+    r" - Remastered \d{4}",
+    r" - Version \d{4}",
+    r" \(?\d{4} Remaster\)?",
+    r"(?i: \(feat\. [\w &,\.]+\))",
+    r" -ed$",
+)
+TITLE_NOISE_LITERALS = (
+    ' - 12" Version',
+    ' - Special 12" Dance Mix',
+    " - (Original Single Mono Version)",
+    " - 7 inch",
+    " - Acoustic",
+    " - Edit",
+    " - Extended Version",
+    " - Full Length Version",
+    " - Instrumental Version",
+    " - Live",
+    " - New Stereo Mix",
+    " - Original Album Version",
+    " - Original Mix",
+    " - Radio Edit",
+    " - Radio Version",
+    " - Re-mastered",
+    " - Remaster",
+    " - Remastered Version",
+    " - Remastered",
+    " - Remix",
+    " - Single Edit",
+    " - Single Mix",
+    " - Single Version",
+    " - Soundtrack Version",
+    " -ed Version",
+    " (Avicii Remix)",
+    " (Digitally Remastered)",
+    " (Live)",
+    " (Radio Edit)",
+    " (Single Version)",
+    " [Radio Edit]",
+    " Radio Edit",
+)
+# every pattern and literal above contains at least one of these, titles without any of them can skip the regex
+TITLE_NOISE_MARKERS = (" -", " (", " [", "Remaster", " Radio Edit")
+# alternation picks the first alternative that matches so longer literals have to go first
+TITLE_NOISE_RE = re.compile(
+    "|".join(
+        (
+            *TITLE_NOISE_PATTERNS,
+            *(re.escape(literal) for literal in sorted(TITLE_NOISE_LITERALS, key=len, reverse=True)),
+        ),
+    ),
+)
 
 
 def extract() -> Generator[models.Song, None, None]:
     dotenv.load_dotenv(verbose=True)
-    sp = spotipy.Spotify(
-        auth_manager=SpotifyOAuth(
-            client_id=getenv("SPOTIPY_CLIENT_ID"),
-            client_secret=getenv("SPOTIPY_CLIENT_SECRET"),
-            redirect_uri=getenv("SPOTIPY_REDIRECT_URI"),
-            scope="user-library-read",
-        ),
+    auth_manager = SpotifyOAuth(
+        client_id=getenv("SPOTIPY_CLIENT_ID"),
+        client_secret=getenv("SPOTIPY_CLIENT_SECRET"),
+        redirect_uri=getenv("SPOTIPY_REDIRECT_URI"),
+        scope="user-library-read",
     )
+    sp = spotipy.Spotify(auth_manager=auth_manager)
     logger.info("Retrieving liked songs from Spotify...")
     total_songs = sp.current_user_saved_tracks(limit=1)["total"] # type: ignore  # noqa: PGH003
-    limit = 50
-    for i in tqdm(range(0, total_songs + 1, limit), desc="Fetching liked songs", unit="batch"):
-        yield from _get_liked_songs(client=sp, offset=i, limit=limit)
+    pages = asyncio.run(_get_all_liked_songs(auth_manager=auth_manager, total_songs=total_songs))
+    for page in pages:
+        yield from page
     logger.info("Done.")
 
 
-def _get_liked_songs(client: spotipy.Spotify, offset: int = 0, limit: int = 50) -> Generator[models.Song, None, None]:
-    logger.debug("Requesting liked songs from Spotify (offset=%d, limit=%d)...", offset, limit)
-    results = client.current_user_saved_tracks(limit=limit, offset=offset)
-    assert results is not None  # noqa: S101
-    for item in results["items"]:
-        track = item["track"]
-        title: str = track["name"]
-        title = re.sub(r" \(?\d{4} Remaster\)?", "", title)
-        title = re.sub(r" - Remastered \d{4}", "", title)
-        title = re.sub(r" - Version \d{4}", "", title)
-        title = re.sub(r" - \d{4} Version", "", title)
-        title = re.sub(r" - \d{4} Remix", "", title)
-        title = re.sub(r" - \d{4} Digital Remaster", "", title)
-        title = re.sub(r" - \d{4} Remastered Version", "", title)
-        title = re.sub(r" \(feat\. [\w &,\.]+\)", "", title, flags=re.IGNORECASE)
-        title = re.sub(" -ed$", "", title)
-        title = (
-            title
-            .replace(' - 12" Version', "")
-            .replace(' - Special 12" Dance Mix', "")
-            .replace(" - (Original Single Mono Version)", "")
-            .replace(" - 7 inch", "")
-            .replace(" - Acoustic", "")
-            .replace(" - Edit", "")
-            .replace(" - Extended Version", "")
-            .replace(" - Full Length Version", "")
-            .replace(" - Instrumental Version", "")
-            .replace(" - Live", "")
-            .replace(" - New Stereo Mix", "")
-            .replace(" - Original Album Version", "")
-            .replace(" - Original Mix", "")
-            .replace(" - Radio Edit", "")
-            .replace(" - Radio Version", "")
-            .replace(" - Re-mastered", "")
-            .replace(" - Remaster", "")
-            .replace(" - Remastered Version", "")
-            .replace(" - Remastered", "")
-            .replace(" - Remix", "")
-            .replace(" - Single Edit", "")
-            .replace(" - Single Mix", "")
-            .replace(" - Single Version", "")
-            .replace(" - Soundtrack Version", "")
-            .replace(" -ed Version", "")
-            .replace(" (Avicii Remix)", "")
-            .replace(" (Digitally Remastered)", "")
-            .replace(" (Live)", "")
-            .replace(" (Radio Edit)", "")
-            .replace(" (Single Version)", "")
-            .replace(" [Radio Edit]", "")
-            .replace(" Radio Edit", "")
-            .strip()
-            .rstrip("-")
-            .rstrip()
+def _authorization_header(auth_manager: SpotifyOAuth) -> str:
+    # spotipy returns cached access token and refreshes it when it is expired
+    access_token: str = auth_manager.get_access_token(as_dict=False)  # type: ignore  # noqa: PGH003
+    return f"Bearer {access_token}"
+
+
+async def _get_all_liked_songs(
+    auth_manager: SpotifyOAuth,
+    total_songs: int,
+    limit: int = 50,
+) -> list[list[models.Song]]:
+    """Fetch all pages of liked songs concurrently. Returns list of pages in the original order."""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    offsets = range(0, total_songs, limit)
+    headers = {"Authorization": _authorization_header(auth_manager)}
+    async with httpx.AsyncClient(headers=headers, http2=True) as client:
+        with tqdm(total=len(offsets), desc="Fetching liked songs", unit="batch") as progress_bar:
+
+            async def fetch(offset: int) -> list[models.Song]:
+                songs = await _get_liked_songs(
+                    client=client,
+                    auth_manager=auth_manager,
+                    semaphore=semaphore,
+                    offset=offset,
+                    limit=limit,
+                )
+                progress_bar.update()
+                return songs
+
+            # if any page fails the task group cancels the others before the client is closed
+            async with asyncio.TaskGroup() as task_group:
+                pages_tasks = [task_group.create_task(fetch(offset)) for offset in offsets]
+    return [task.result() for task in pages_tasks]
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Network problems, server errors and expired access token are usually temporary, other errors are not."""
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        return status_code == HTTPStatus.UNAUTHORIZED or status_code >= HTTPStatus.INTERNAL_SERVER_ERROR
+    return isinstance(error, httpx.TransportError)
+
+
+async def _get_liked_songs(
+    client: httpx.AsyncClient,
+    auth_manager: SpotifyOAuth,
+    semaphore: asyncio.Semaphore,
+    offset: int = 0,
+    limit: int = 50,
+    max_tries: int = 5,
+) -> list[models.Song]:
+    try_number = 1
+    while True:
+        logger.debug(
+            "Requesting liked songs from Spotify (offset=%d, limit=%d, try: %d/%d)...",
+            offset,
+            limit,
+            try_number,
+            max_tries,
         )
+        try:
+            response = await http_get_async(
+                client=client,
+                url=f"{SAVED_TRACKS_URL}?limit={limit}&offset={offset}",
+                semaphore=semaphore,
+            )
+            results = response.json()
+            return list(_parse_liked_songs(results["items"]))
+        except Exception as e:
+            if try_number >= max_tries or not _is_retryable(e):
+                raise
+            if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == HTTPStatus.UNAUTHORIZED:
+                # access token can expire during a long wait for Retry-After, refreshing it might need a request
+                client.headers["Authorization"] = await asyncio.to_thread(_authorization_header, auth_manager)
+            wait_period = backoff_delay(try_number)
+            logger.exception("Error while requesting liked songs: %s. Retrying in %s.", e, wait_period)
+            await asyncio.sleep(wait_period.total_seconds())
+        try_number += 1
+
+
+def _clean_title(title: str) -> str:
+    # most titles have no noise at all and substring checks are much cheaper than running the regex
+    if any(marker in title for marker in TITLE_NOISE_MARKERS):
+        title = TITLE_NOISE_RE.sub("", title)
+    return title.strip().rstrip("-").rstrip()
+
+
+def _parse_liked_songs(items: list[dict]) -> Generator[models.Song, None, None]:
+    for item in items:
+        track = item["track"]
+        title = _clean_title(track["name"])
         if title:
             for a in track["artists"]:
                 artist: str = a["name"]
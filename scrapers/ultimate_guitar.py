@@ -1,19 +1,22 @@
+import asyncio
 import dataclasses
-import json
 import logging
+import re
 import sqlite3
-import time
 from collections.abc import Generator
-from datetime import timedelta
+from html import unescape
+from http import HTTPStatus
+from operator import attrgetter
 from pathlib import Path
 from string import ascii_lowercase
 
 import httpx
-from bs4 import BeautifulSoup
+import orjson
+from selectolax.lexbor import LexborHTMLParser
 from tqdm import tqdm
 
 from scrapers import models
-from scrapers.utils import http_get
+from scrapers.utils import HostRateLimiter, backoff_delay, http_get_async
 
 logger = logging.getLogger(__name__)
 ARTIST_PAGES = (
@@ -23,27 +26,70 @@ ARTIST_PAGES = (
 BASE_URL = "https://www.ultimate-guitar.com"
 BANDS_URL_PATTERN = BASE_URL + "/bands/{prefix}{page_number}.htm"
 ARTIST_MIN_NUMBER_OF_SONGS = 5
+MAX_CONCURRENT_REQUESTS = 64
+MAX_REQUESTS_PER_SECOND = 20
+ARTIST_PAGES_WORKERS = 32
+DB_COMMIT_EVERY_N_URLS = 1_000
+SKIPPED_MARKETING_TYPES = frozenset(("TabPro", "official"))
+# values of all SongChordsLink fields in the order of tabs table columns
+TAB_ROW = attrgetter(*(field.name for field in dataclasses.fields(models.SongChordsLink)))
+# the page store is the only thing we need from the page, matching it directly is much cheaper than building the DOM
+JS_STORE_RE = re.compile(rb'class="js-store"[^>]*?data-content="([^"]*)"')
+DB_PRAGMAS = (
+    "pragma journal_mode=wal",
+    "pragma synchronous=normal",  # wal keeps the db consistent, we can only lose the last commits on power loss
+    "pragma temp_store=memory",
+    "pragma cache_size=-262144",  # 256 MiB
+    "pragma mmap_size=268435456",  # 256 MiB
+)
+
+
+class PageDataError(Exception):
+    """Page was downloaded but the data embedded in it is missing or malformed."""
 
 
 def parse(db_path: Path | None = None) -> Generator[models.SongChordsLink, None, None]:
     logger.info("Starting...")
     conn_path = db_path if db_path is not None else ":memory:"
-    db = sqlite3.connect(conn_path, isolation_level=None)
+    # writes of parsed tabs are done in a worker thread, but never concurrently with anything else using the db
+    db = sqlite3.connect(conn_path, isolation_level=None, check_same_thread=False)
     try:
-        cursor = db.execute("pragma journal_mode=wal")
-        cursor.execute("CREATE TABLE IF NOT EXISTS urls(url TEXT NOT NULL, parsed TEXT)")
+        cursor = db.cursor()
+        for pragma in DB_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.execute("CREATE TABLE IF NOT EXISTS urls(url TEXT NOT NULL, parsed INTEGER)")
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tabs(
+                url_id INTEGER NOT NULL REFERENCES urls(rowid),
+                artist TEXT NOT NULL,
+                title TEXT NOT NULL,
+                url TEXT NOT NULL,
+                version INTEGER,
+                rating REAL,
+                votes REAL,
+                difficulty TEXT,
+                tonality_name TEXT,
+                views INTEGER
+            )
+            """,
+        )
+        # urls parsed by older versions of the scraper kept results as json in the parsed column, parse them again,
+        # dbs created by them have text affinity of the parsed column so urls parsed since then have '1' text in it
+        legacy_parsed = "typeof(parsed) = 'blob' OR (typeof(parsed) = 'text' AND parsed <> '1')"
+        cursor.execute("BEGIN")
+        cursor.execute(f"DELETE FROM tabs WHERE url_id IN (SELECT rowid FROM urls WHERE {legacy_parsed})")  # noqa: S608
+        cursor.execute(f"UPDATE urls SET parsed = NULL WHERE {legacy_parsed}")  # noqa: S608
+        db.commit()
         cursor.execute("SELECT count(*) as cnt FROM urls")
         numbers_of_urls_in_db = cursor.fetchone()[0]
         if numbers_of_urls_in_db > 0:
             logger.info("Number of urls in db: %d", numbers_of_urls_in_db)
         else:
             logger.info("No urls in db. Starting from scratch.")
+            artist_pages_urls = asyncio.run(_gather_artist_pages_urls())
             cursor.execute("BEGIN")
-            with httpx.Client(follow_redirects=True) as client:
-                for prefix in tqdm(ARTIST_PAGES, unit="prefix", desc="Artist pages prefixes"):
-                    artist_pages_urls = _get_artist_pages_urls(client=client, prefix=prefix)
-                    for url in artist_pages_urls:
-                        cursor.execute("INSERT INTO urls(url) VALUES (?)", (url,))
+            cursor.executemany("INSERT INTO urls(url) VALUES (?)", ((url,) for url in artist_pages_urls))
             db.commit()
             cursor.execute("SELECT count(*) as cnt FROM urls")
             numbers_of_urls_in_db = cursor.fetchone()[0]
@@ -54,115 +100,276 @@ def parse(db_path: Path | None = None) -> Generator[models.SongChordsLink, None,
             logger.info("Number of urls to parse: %d", numbers_of_urls_to_parse)
             cursor.execute("SELECT url, rowid FROM urls WHERE parsed IS NULL")
             urls_to_parse = cursor.fetchall()
-            cursor.execute("BEGIN")
-            with httpx.Client(follow_redirects=True) as client:
-                for i, row in tqdm(enumerate(urls_to_parse), total=len(urls_to_parse), unit="url", desc="Parsing urls"):
-                    url, rowid = row
-                    parsed = [dataclasses.asdict(c) for c in _get_chord_pages(client=client, artist_page_url=url)]
-                    cursor.execute("UPDATE urls SET parsed = ? WHERE rowid = ?", (json.dumps(parsed), rowid))
-                    if i % 1_000 == 0:
-                        logger.debug("Committing. (i: %d)", i)
-                        db.commit()
-                db.commit()
-        cursor.execute("SELECT parsed FROM urls")
+            asyncio.run(_parse_artist_pages(db=db, urls_to_parse=urls_to_parse))
+        cursor.execute("SELECT count(*) as cnt FROM tabs")
+        numbers_of_tabs_in_db = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT artist, title, url, version, rating, votes, difficulty, tonality_name, views FROM tabs",
+        )
         logger.info("Yielding content from db...")
-        for _ in tqdm(range(numbers_of_urls_in_db), unit="row"):
-            content = cursor.fetchone()[0]
-            parsed_content: list[dict] = json.loads(content)
-            for entry in parsed_content:
-                tab = models.SongChordsLink(**entry)
-                yield tab
+        for row in tqdm(cursor, total=numbers_of_tabs_in_db, unit="row"):
+            yield models.SongChordsLink(*row)
         logger.info("Done.")
     finally:
         db.close()
 
 
+def _save_parsed_tabs(db: sqlite3.Connection, tabs: list[tuple], parsed_rowids: list[tuple[int]]) -> None:
+    logger.debug("Committing %d tabs from %d urls.", len(tabs), len(parsed_rowids))
+    db.execute("BEGIN")
+    db.executemany("INSERT INTO tabs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", tabs)
+    db.executemany("UPDATE urls SET parsed = 1 WHERE rowid = ?", parsed_rowids)
+    db.commit()
+
+
 def _parse_chord_page_data(data: list[dict]) -> Generator[models.SongChordsLink, None, None]:
+    song_chords_link = models.SongChordsLink
     for tab in data:
         if (
-            tab.get("marketing_type", "") not in ("TabPro", "official")
+            tab.get("marketing_type", "") not in SKIPPED_MARKETING_TYPES
             and tab["type"] == "Chords"
             and tab["tuning"] == "Standard"
         ):
-            yield models.SongChordsLink(
+            # empty values (0, "") mean that the value is missing
+            yield song_chords_link(
                 artist=tab["artist_name"],
                 title=tab["song_name"],
                 url=tab["tab_url"],
                 version=tab["version"],
-                rating=tab["rating"] if tab["rating"] else None,
-                votes=tab["votes"] if tab["votes"] else None,
-                difficulty=tab["difficulty"] if tab["difficulty"] else None,
-                tonality_name=tab["tonality_name"] if tab["tonality_name"] else None,
+                rating=tab["rating"] or None,
+                votes=tab["votes"] or None,
+                difficulty=tab["difficulty"] or None,
+                tonality_name=tab["tonality_name"] or None,
             )
 
 
-def _get_chord_pages(client: httpx.Client, artist_page_url: str) -> Generator[models.SongChordsLink, None, None]:
-    # yield data from the first page
-    data = _get_page_data(client=client, url=artist_page_url)
+async def _get_chord_pages(
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    rate_limiter: HostRateLimiter,
+    artist_page_url: str,
+) -> list[models.SongChordsLink]:
+    # data from the first page
+    data = await _get_page_data_async(
+        client=client,
+        semaphore=semaphore,
+        rate_limiter=rate_limiter,
+        url=artist_page_url,
+    )
     data = data["store"]["page"]["data"]
-    yield from _parse_chord_page_data(data["other_tabs"])
-    # yield data from the other pages
+    chord_pages = list(_parse_chord_page_data(data["other_tabs"]))
+    # data from the other pages, fetched concurrently but added in page order
     current_page: int = data["pagination"]["current"]
     pages: list[dict] = [p for p in data["pagination"]["pages"] if p["page"] > current_page]
-    for page in pages:
-        page_url = BASE_URL + page["url"]
-        data = _get_page_data(client=client, url=page_url)
-        data = data["store"]["page"]["data"]
-        yield from _parse_chord_page_data(data["other_tabs"])
-
-
-def _get_artist_pages_urls(client: httpx.Client, prefix: str) -> Generator[str, None]:
-    for url in _get_list_of_artist_pages_urls(client=client, prefix=prefix):
-        data = _get_page_data(client=client, url=url)
-        data = data["store"]["page"]["data"]
-        for artist in data["artists"]:
-            if artist["tabscount"] >= ARTIST_MIN_NUMBER_OF_SONGS:  # filter out artists who have very few songs
-                artist_page_url = f"{BASE_URL}{artist['artist_url']}?filter=chords"  # add filter to only get chords
-                yield artist_page_url
-
-
-def _get_list_of_artist_pages_urls(client: httpx.Client, prefix: str) -> Generator[str, None]:
-    first_page_url = BANDS_URL_PATTERN.format(prefix=prefix, page_number="")
-    data = _get_page_data(client=client, url=first_page_url)
-    data = data["store"]["page"]["data"]
-    num_pages = data["page_count"]
-    yield first_page_url
-    for page_number in tqdm(
-        iterable=range(2, num_pages + 1),
-        unit="page",
-        desc=f"Artist pages for prefix: [{prefix}]",
-        total=num_pages,
-        initial=1,
-    ):
-        yield BANDS_URL_PATTERN.format(prefix=prefix, page_number=page_number)
-
-
-def _get_page_data(
-    client: httpx.Client,
+    async with asyncio.TaskGroup() as task_group:
+        pages_tasks = [
+            task_group.create_task(
+                _get_page_data_async(
+                    client=client,
+                    semaphore=semaphore,
+                    rate_limiter=rate_limiter,
+                    url=BASE_URL + page["url"],
+                ),
+            )
+            for page in pages
+        ]
+    for page_task in pages_tasks:
+        data = page_task.result()["store"]["page"]["data"]
+        chord_pages.extend(_parse_chord_page_data(data["other_tabs"]))
+    return chord_pages
+
+
+async def _parse_artist_pages(db: sqlite3.Connection, urls_to_parse: list[tuple[str, int]]) -> None:
+    """Fetch chords from artist pages concurrently and save them to the db as they come in."""
+    urls_queue: asyncio.Queue[tuple[str, int]] = asyncio.Queue()
+    for row in urls_to_parse:
+        urls_queue.put_nowait(row)
+    # None signals the writer that there will be no more results
+    results_queue: asyncio.Queue[tuple[int, list[models.SongChordsLink]] | None] = asyncio.Queue()
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    rate_limiter = HostRateLimiter(requests_per_second=MAX_REQUESTS_PER_SECOND, burst=MAX_REQUESTS_PER_SECOND)
+    writer = asyncio.create_task(_tabs_writer(db=db, results_queue=results_queue, total=len(urls_to_parse)))
+    async with _async_client() as client:
+        try:
+            # if any worker fails the task group cancels the others
+            async with asyncio.TaskGroup() as task_group:
+                for _ in range(ARTIST_PAGES_WORKERS):
+                    task_group.create_task(
+                        _artist_page_worker(
+                            client=client,
+                            semaphore=semaphore,
+                            rate_limiter=rate_limiter,
+                            urls_queue=urls_queue,
+                            results_queue=results_queue,
+                        ),
+                    )
+        finally:
+            # save whatever was parsed so far even if some worker failed so that the next run can resume
+            results_queue.put_nowait(None)
+            await writer
+
+
+async def _artist_page_worker(
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    rate_limiter: HostRateLimiter,
+    urls_queue: asyncio.Queue[tuple[str, int]],
+    results_queue: asyncio.Queue[tuple[int, list[models.SongChordsLink]] | None],
+) -> None:
+    while True:
+        try:
+            url, rowid = urls_queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        chord_pages = await _get_chord_pages(
+            client=client,
+            semaphore=semaphore,
+            rate_limiter=rate_limiter,
+            artist_page_url=url,
+        )
+        results_queue.put_nowait((rowid, chord_pages))
+
+
+async def _tabs_writer(
+    db: sqlite3.Connection,
+    results_queue: asyncio.Queue[tuple[int, list[models.SongChordsLink]] | None],
+    total: int,
+) -> None:
+    # only this coroutine writes to the db so writes are never interleaved
+    tabs: list[tuple] = []
+    parsed_rowids: list[tuple[int]] = []
+    with tqdm(total=total, unit="url", desc="Parsing urls") as progress_bar:
+        while (result := await results_queue.get()) is not None:
+            rowid, chord_pages = result
+            tabs.extend((rowid, *TAB_ROW(tab)) for tab in chord_pages)
+            parsed_rowids.append((rowid,))
+            progress_bar.update()
+            if len(parsed_rowids) >= DB_COMMIT_EVERY_N_URLS:
+                # commit in a thread so that waiting for disk does not stall http requests running on the event loop
+                await asyncio.to_thread(_save_parsed_tabs, db=db, tabs=tabs, parsed_rowids=parsed_rowids)
+                tabs = []
+                parsed_rowids = []
+    await asyncio.to_thread(_save_parsed_tabs, db=db, tabs=tabs, parsed_rowids=parsed_rowids)
+
+
+def _async_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=MAX_CONCURRENT_REQUESTS,
+        max_keepalive_connections=MAX_CONCURRENT_REQUESTS,
+    )
+    # with http2 concurrent requests are multiplexed over a few connections instead of doing a TLS handshake for each
+    return httpx.AsyncClient(limits=limits, http2=True, follow_redirects=True)
+
+
+async def _gather_artist_pages_urls() -> list[str]:
+    """Crawl artist listing pages of all prefixes concurrently and return urls of artist pages."""
+    artist_pages_urls: list[str] = []
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    rate_limiter = HostRateLimiter(requests_per_second=MAX_REQUESTS_PER_SECOND, burst=MAX_REQUESTS_PER_SECOND)
+    async with _async_client() as client:
+        # first page of each prefix tells us how many listing pages there are for it
+        first_pages_urls = [BANDS_URL_PATTERN.format(prefix=prefix, page_number="") for prefix in ARTIST_PAGES]
+        async with asyncio.TaskGroup() as task_group:
+            first_pages_tasks = [
+                task_group.create_task(
+                    _get_page_data_async(client=client, semaphore=semaphore, rate_limiter=rate_limiter, url=url),
+                )
+                for url in first_pages_urls
+            ]
+        queue: asyncio.Queue[str] = asyncio.Queue()
+        for prefix, first_page_task in zip(ARTIST_PAGES, first_pages_tasks, strict=True):
+            data = first_page_task.result()["store"]["page"]["data"]
+            artist_pages_urls.extend(_filter_artist_pages_urls(data["artists"]))
+            for page_number in range(2, data["page_count"] + 1):
+                queue.put_nowait(BANDS_URL_PATTERN.format(prefix=prefix, page_number=page_number))
+        with tqdm(total=queue.qsize(), unit="page", desc="Artist listing pages") as progress_bar:
+            async with asyncio.TaskGroup() as task_group:
+                for _ in range(MAX_CONCURRENT_REQUESTS):
+                    task_group.create_task(
+                        _artist_listing_worker(
+                            client=client,
+                            semaphore=semaphore,
+                            rate_limiter=rate_limiter,
+                            queue=queue,
+                            artist_pages_urls=artist_pages_urls,
+                            progress_bar=progress_bar,
+                        ),
+                    )
+    return artist_pages_urls
+
+
+async def _artist_listing_worker(
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    rate_limiter: HostRateLimiter,
+    queue: asyncio.Queue[str],
+    artist_pages_urls: list[str],
+    progress_bar: tqdm,
+) -> None:
+    while True:
+        try:
+            url = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        data = await _get_page_data_async(client=client, semaphore=semaphore, rate_limiter=rate_limiter, url=url)
+        artist_pages_urls.extend(_filter_artist_pages_urls(data["store"]["page"]["data"]["artists"]))
+        progress_bar.update()
+
+
+def _filter_artist_pages_urls(artists: list[dict]) -> Generator[str, None, None]:
+    for artist in artists:
+        if artist["tabscount"] >= ARTIST_MIN_NUMBER_OF_SONGS:  # filter out artists who have very few songs
+            artist_page_url = f"{BASE_URL}{artist['artist_url']}?filter=chords"  # add filter to only get chords
+            yield artist_page_url
+
+
+def _extract_page_data(html: bytes) -> dict:
+    match = JS_STORE_RE.search(html)
+    if match is not None:
+        data_attribute = unescape(match.group(1).decode(errors="replace"))
+    else:
+        # markup might differ from what the regex expects (e.g. different attribute quoting), let the parser handle it
+        node = LexborHTMLParser(html).css_first("body .js-store")
+        if node is None:
+            raise PageDataError("No data element in response")
+        data_attribute = node.attributes.get("data-content")
+    if not data_attribute:
+        raise PageDataError("No data attribute in response")
+    try:
+        parsed_data_attribute: dict = orjson.loads(data_attribute)
+        has_data = bool(parsed_data_attribute["store"]["page"]["data"])
+    except (orjson.JSONDecodeError, KeyError, TypeError) as e:
+        raise PageDataError("Malformed data in response") from e
+    if not has_data:
+        raise PageDataError("No data in response")
+    return parsed_data_attribute
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Network problems, server errors and incomplete pages are usually temporary, other errors are not."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR
+    return isinstance(error, httpx.TransportError | PageDataError)
+
+
+async def _get_page_data_async(
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
+    rate_limiter: HostRateLimiter,
     url: str,
-    try_number: int = 1,
     max_tries: int = 5,
-    wait_period: timedelta = timedelta(seconds=30),
 ) -> dict:
-    logger.debug("Checking page: %s (try: %d/%d)", url, try_number, max_tries)
-    try:
-        response = http_get(client=client, url=url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, features="html.parser")
-        data_attribute: str = soup.find("body").select_one(".js-store")["data-content"]  # type: ignore  # noqa: PGH003
-        parsed_data_attribute: dict = json.loads(data_attribute)
-        if not parsed_data_attribute["store"]["page"]["data"]:
-            raise Exception("No data in response")
-        return parsed_data_attribute
-    except Exception as e:
-        if try_number >= max_tries:
-            raise e
-        logger.exception("Error while processing page: %s. Retrying in %s.", e, wait_period)
-        time.sleep(wait_period.total_seconds())
-        return _get_page_data(
-            client=client,
-            url=url,
-            try_number=try_number + 1,
-            max_tries=max_tries,
-            wait_period=wait_period,
-        )
+    try_number = 1
+    while True:
+        logger.debug("Checking page: %s (try: %d/%d)", url, try_number, max_tries)
+        try:
+            # only the request itself holds the semaphore so that sleeping between retries does not block others
+            response = await http_get_async(client=client, url=url, rate_limiter=rate_limiter, semaphore=semaphore)
+            return _extract_page_data(response.content)
+        except Exception as e:
+            if try_number >= max_tries or not _is_retryable(e):
+                raise
+            wait_period = backoff_delay(try_number)
+            logger.exception("Error while processing page: %s. Retrying in %s.", e, wait_period)
+            await asyncio.sleep(wait_period.total_seconds())
+        try_number += 1
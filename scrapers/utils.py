@@ -1,8 +1,9 @@
 import asyncio
 import logging
+import random
 import time
 from asyncio import sleep as async_sleep
-from collections.abc import AsyncGenerator, Generator
+from contextlib import nullcontext
 from datetime import timedelta
 from http import HTTPStatus
 
@@ -10,39 +11,75 @@ import httpx
 
 logger = logging.getLogger(__name__)
 
-def http_get(
-    client: httpx.Client,
-    url: str,
-    timeout_s: int = 30,
-    wait_default_delay: timedelta = timedelta(seconds=30),
-    try_number: int = 1,
-    max_tries: int = 5,
-) -> httpx.Response:
+
+class HostRateLimiter:
+    """Limits number of requests per second sent to each host.
+
+    Every request reserves the next free time slot for its host, up to `burst` requests can be sent at once.
+    When server tells us to slow down, `pause` makes requests still waiting for their slot reserve a new one after
+    the pause, so that all pending requests wait together.
+    """
+
+    def __init__(self, requests_per_second: float, burst: int = 1) -> None:
+        self.interval = 1 / requests_per_second
+        self.burst = burst
+        self._next_slot: dict[str, float] = {}
+        self._paused_until: dict[str, float] = {}
+
+    async def acquire(self, url: str) -> None:
+        host = httpx.URL(url).host
+        while True:
+            start = max(time.monotonic(), self._paused_until.get(host, 0.0))
+            slot = max(self._next_slot.get(host, start), start)
+            self._next_slot[host] = slot + self.interval
+            send_at = max(slot - (self.burst - 1) * self.interval, start)
+            delay = send_at - time.monotonic()
+            if delay > 0:
+                await async_sleep(delay)
+            # host might have been paused while we were waiting, then the reserved slot is no longer valid
+            if self._paused_until.get(host, 0.0) <= time.monotonic():
+                return
+
+    def pause(self, url: str, wait_period: timedelta) -> None:
+        host = httpx.URL(url).host
+        resume_at = time.monotonic() + wait_period.total_seconds()
+        self._paused_until[host] = max(self._paused_until.get(host, resume_at), resume_at)
+
+
+def backoff_delay(
+    try_number: int,
+    base_delay: timedelta = timedelta(seconds=5),
+    max_delay: timedelta = timedelta(seconds=60),
+) -> timedelta:
+    """Exponential backoff with jitter so that requests that failed at the same time are not retried together."""
+    delay = min(base_delay * 2 ** (try_number - 1), max_delay)
+    return delay * random.uniform(0.5, 1.0)  # noqa: S311
+
+
+def _retry_after_wait_period(response: httpx.Response, wait_default_delay: timedelta) -> timedelta:
     wait_period = wait_default_delay
-    response = client.get(url=url, timeout=timeout_s)
-    if response.status_code == HTTPStatus.TOO_MANY_REQUESTS:
-        retry_after_raw = response.headers.get("Retry-After")
-        if retry_after_raw:
-            logger.debug("Server sent 429 status code with Retry-After header value: %s", retry_after_raw)
-            try:
-                retry_after = timedelta(seconds=int(retry_after_raw))
-                # sometimes server sends too low value in Retry-After header
-                # so let's make sure we wait at least 30 seconds
-                wait_period = max(retry_after, wait_default_delay)
-            except ValueError:
-                pass  # if Retry-After is not a number, we will use default wait_period
-        logger.warning("Server sent 429 (Too Many Requests) status code. Going to sleep for: %s", wait_period)
-        time.sleep(wait_period.total_seconds())
-        return http_get(
-            client=client,
-            url=url,
-            timeout_s=timeout_s,
-            wait_default_delay=wait_period,
-            try_number=try_number + 1,
-            max_tries=max_tries,
+    retry_after_raw = response.headers.get("Retry-After")
+    if retry_after_raw:
+        logger.debug(
+            "Server sent %d status code with Retry-After header value: %s",
+            response.status_code,
+            retry_after_raw,
         )
-    response.raise_for_status()
-    return response
+        try:
+            retry_after = timedelta(seconds=int(retry_after_raw))
+            # sometimes server sends too low value in Retry-After header
+            # so let's make sure we wait at least 30 seconds
+            wait_period = max(retry_after, wait_default_delay)
+        except ValueError:
+            pass  # if Retry-After is not a number, we will use default wait_period
+    return wait_period
+
+
+def _should_wait_and_retry(response: httpx.Response) -> bool:
+    """Server asked us to slow down or told us when it will be available again."""
+    if response.status_code == HTTPStatus.TOO_MANY_REQUESTS:
+        return True
+    return response.status_code == HTTPStatus.SERVICE_UNAVAILABLE and "Retry-After" in response.headers
 
 
 async def http_get_async(
@@ -50,41 +87,30 @@ async def http_get_async(
     url: str,
     timeout_s: int = 30,
     wait_default_delay: timedelta = timedelta(seconds=30),
-    try_number: int = 1,
     max_tries: int = 5,
+    rate_limiter: HostRateLimiter | None = None,
+    semaphore: asyncio.Semaphore | None = None,
 ) -> httpx.Response:
-    wait_period = wait_default_delay
-    response = await client.get(url=url, timeout=timeout_s)
-    if response.status_code == HTTPStatus.TOO_MANY_REQUESTS:
-        retry_after_raw = response.headers.get("Retry-After")
-        if retry_after_raw:
-            logger.debug("Server sent 429 status code with Retry-After header value: %s", retry_after_raw)
-            try:
-                retry_after = timedelta(seconds=int(retry_after_raw))
-                # sometimes server sends too low value in Retry-After header
-                # so let's make sure we wait at least 30 seconds
-                wait_period = max(retry_after, wait_default_delay)
-            except ValueError:
-                pass  # if Retry-After is not a number, we will use default wait_period
-        logger.warning("Server sent 429 (Too Many Requests) status code. Going to sleep for: %s", wait_period)
-        await async_sleep(wait_period.total_seconds())
-        return await http_get_async(
-            client=client,
-            url=url,
-            timeout_s=timeout_s,
-            wait_default_delay=wait_period,
-            try_number=try_number + 1,
-            max_tries=max_tries,
+    for try_number in range(1, max_tries + 1):
+        # semaphore is only held for the request itself so that waiting for retry does not block other requests
+        async with semaphore or nullcontext():
+            if rate_limiter is not None:
+                await rate_limiter.acquire(url)
+            response = await client.get(url=url, timeout=timeout_s)
+        if not _should_wait_and_retry(response) or try_number == max_tries:
+            break
+        # the longest wait so far becomes the minimum for the next retries
+        wait_default_delay = _retry_after_wait_period(response, wait_default_delay)
+        logger.warning(
+            "Server sent %d status code. Going to sleep for: %s (try: %d/%d)",
+            response.status_code,
+            wait_default_delay,
+            try_number,
+            max_tries,
         )
+        if rate_limiter is not None:
+            # make other requests to the same host wait as well instead of hitting the limit again
+            rate_limiter.pause(url, wait_default_delay)
+        await async_sleep(wait_default_delay.total_seconds())
     response.raise_for_status()
     return response
-
-
-def async_to_sync_generator(loop: asyncio.AbstractEventLoop, async_gen: AsyncGenerator) -> Generator:
-    """Convert an async generator into a regular generator."""
-    while True:
-        try:
-            task = asyncio.run_coroutine_threadsafe(async_gen.__anext__(), loop)
-            yield task.result()
-        except StopAsyncIteration:
-            break
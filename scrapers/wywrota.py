@@ -1,18 +1,18 @@
+import asyncio
 import logging
 import string
-import time
 from collections.abc import Generator
-from datetime import timedelta
 from typing import NamedTuple
 
 import httpx
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
 
 from scrapers import models
-from scrapers.utils import http_get
+from scrapers.utils import backoff_delay, http_get_async
 
 logger = logging.getLogger(__name__)
 ARTISTS_URL_PATTERN = "https://spiewnik.wywrota.pl/country/PL/letter/{letter}/artists"
+MAX_CONCURRENT_REQUESTS = 8
 
 
 class ArtistPage(NamedTuple):
@@ -27,80 +27,109 @@ class SongPage(NamedTuple):
 
 
 def parse() -> Generator[models.SongChordsLink, None, None]:
-    with httpx.Client() as client:
-        for letter in string.ascii_uppercase:
-            for ap in _get_artists_pages(client=client, letter=letter):
-                songs_with_tabs = 0
-                songs_without_tabs = 0
-                songs_pages = _get_songs_pages(client=client, artist_page_url=ap.artist_page_url)
-                for sp in songs_pages:
-                    if sp.instrument_icon == "Gitara":
-                        songs_with_tabs += 1
-                        yield models.SongChordsLink(
-                            artist=ap.artist_name,
-                            title=sp.song_name,
-                            url=sp.song_url,
-                        )
-                    else:
-                        songs_without_tabs += 1
-                logger.info(
-                    "Artist: %s - songs with tabs: %d, songs without tabs: %d",
-                    ap.artist_name,
-                    songs_with_tabs,
-                    songs_without_tabs,
+    for letter in string.ascii_uppercase:
+        # artists of one letter are fetched concurrently, results are yielded letter by letter
+        artists_songs_pages = asyncio.run(_get_letter_songs_pages(letter=letter))
+        for ap, songs_pages in artists_songs_pages:
+            songs_with_tabs = 0
+            songs_without_tabs = 0
+            for sp in songs_pages:
+                if sp.instrument_icon == "Gitara":
+                    songs_with_tabs += 1
+                    yield models.SongChordsLink(
+                        artist=ap.artist_name,
+                        title=sp.song_name,
+                        url=sp.song_url,
+                    )
+                else:
+                    songs_without_tabs += 1
+            logger.info(
+                "Artist: %s - songs with tabs: %d, songs without tabs: %d",
+                ap.artist_name,
+                songs_with_tabs,
+                songs_without_tabs,
+            )
+
+
+async def _get_letter_songs_pages(letter: str) -> list[tuple[ArtistPage, list[SongPage]]]:
+    """Fetch song lists of all artists starting with given letter. Returns them in the order artists are listed."""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    async with _async_client() as client:
+        artists_pages = await _get_artists_pages(client=client, letter=letter)
+        async with asyncio.TaskGroup() as task_group:
+            songs_pages_tasks = [
+                task_group.create_task(
+                    _get_songs_pages(client=client, semaphore=semaphore, artist_page_url=ap.artist_page_url),
                 )
+                for ap in artists_pages
+            ]
+    return [(ap, task.result()) for ap, task in zip(artists_pages, songs_pages_tasks, strict=True)]
+
+
+def _async_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=MAX_CONCURRENT_REQUESTS,
+        max_keepalive_connections=MAX_CONCURRENT_REQUESTS,
+    )
+    # song lists of one letter are multiplexed over a single http2 connection instead of a handshake per artist
+    return httpx.AsyncClient(limits=limits, http2=True, follow_redirects=True)
 
 
-def _get_artists_pages(
-    client: httpx.Client,
+async def _get_artists_pages(
+    client: httpx.AsyncClient,
     letter: str,
-    try_number: int = 1,
     max_tries: int = 5,
-    wait_period: timedelta = timedelta(seconds=30),
-) -> Generator[ArtistPage, None, None]:
-    logger.info("Checking artists starting with letter: %s (try: %d/%d)", letter, try_number, max_tries)
-    try:
-        response = http_get(client=client, url=ARTISTS_URL_PATTERN.format(letter=letter))
-        soup = BeautifulSoup(response.text, features="html.parser")
-        section = soup.find("body").find("section").find_all("div", class_="row")
-        artists = section[1].find_all("a")
-        if not artists:
-            raise Exception("No artists in response")
-        for artist in artists:
-            artist_name = artist.text.strip()
-            artist_page_url = artist["href"].strip()
-            yield ArtistPage(artist_name=artist_name, artist_page_url=artist_page_url)
-    except Exception as e:
-        if try_number > max_tries:
-            raise e
-        logger.exception("Error while processing page: %s. Retrying in %s.", e, wait_period)
-        time.sleep(wait_period.total_seconds())
-        yield from _get_artists_pages(
-            letter=letter, try_number=try_number + 1, max_tries=max_tries, wait_period=wait_period,
-        )
-
-
-def _get_songs_pages(
-    client: httpx.Client,
+) -> list[ArtistPage]:
+    try_number = 1
+    while True:
+        logger.info("Checking artists starting with letter: %s (try: %d/%d)", letter, try_number, max_tries)
+        try:
+            response = await http_get_async(client=client, url=ARTISTS_URL_PATTERN.format(letter=letter))
+            tree = LexborHTMLParser(response.content)
+            section = tree.body.css_first("section").css("div.row")  # type: ignore  # noqa: PGH003
+            artists = section[1].css("a")
+            if not artists:
+                raise Exception("No artists in response")
+            return [
+                ArtistPage(
+                    artist_name=artist.text().strip(),
+                    artist_page_url=artist.attributes["href"].strip(),  # type: ignore  # noqa: PGH003
+                )
+                for artist in artists
+            ]
+        except Exception as e:
+            if try_number >= max_tries:
+                raise
+            wait_period = backoff_delay(try_number)
+            logger.exception("Error while processing page: %s. Retrying in %s.", e, wait_period)
+            await asyncio.sleep(wait_period.total_seconds())
+        try_number += 1
+
+
+async def _get_songs_pages(
+    client: httpx.AsyncClient,
+    semaphore: asyncio.Semaphore,
     artist_page_url: str,
-    try_number: int = 1,
     max_tries: int = 5,
-    wait_period: timedelta = timedelta(seconds=30),
-) -> Generator[SongPage, None, None]:
-    try:
-        response_artist_page = http_get(client=client, url=artist_page_url)
-        soup_artist_page = BeautifulSoup(response_artist_page.text, features="html.parser")
-        songs_list = soup_artist_page.select_one(".song-list-group").find_all("li")
-        for song in songs_list:
-            instrument_icon = song.find("span")["title"]
-            song_name = song.find("a").text.strip()
-            song_url = song.find("a")["href"]
-            yield SongPage(instrument_icon=instrument_icon, song_name=song_name, song_url=song_url)
-    except Exception as e:
-        if try_number >= max_tries:
-            raise e
-        logger.exception("Error while processing page: %s. Retrying in %s.", e, wait_period)
-        time.sleep(wait_period.total_seconds())
-        yield from _get_songs_pages(
-            artist_page_url=artist_page_url, try_number=try_number + 1, max_tries=max_tries, wait_period=wait_period,
-        )
+) -> list[SongPage]:
+    try_number = 1
+    while True:
+        try:
+            response_artist_page = await http_get_async(client=client, url=artist_page_url, semaphore=semaphore)
+            tree_artist_page = LexborHTMLParser(response_artist_page.content)
+            songs_list = tree_artist_page.css_first(".song-list-group").css("li")  # type: ignore  # noqa: PGH003
+            songs_pages = []
+            for song in songs_list:
+                instrument_icon = song.css_first("span").attributes["title"]  # type: ignore  # noqa: PGH003
+                song_link = song.css_first("a")
+                song_name = song_link.text().strip()  # type: ignore  # noqa: PGH003
+                song_url = song_link.attributes["href"]  # type: ignore  # noqa: PGH003
+                songs_pages.append(SongPage(instrument_icon=instrument_icon, song_name=song_name, song_url=song_url))
+            return songs_pages
+        except Exception as e:
+            if try_number >= max_tries:
+                raise
+            wait_period = backoff_delay(try_number)
+            logger.exception("Error while processing page: %s. Retrying in %s.", e, wait_period)
+            await asyncio.sleep(wait_period.total_seconds())
+        try_number += 1
@@ -0,0 +1,174 @@
+import asyncio
+import re
+
+import httpx
+import pytest
+
+from scrapers import spotify
+from scrapers.spotify import _clean_title, _get_all_liked_songs
+
+# real suffixes of titles of liked songs on Spotify
+TITLE_SUFFIXES = (
+    "",
+    " - 2011 Remastered",
+    " - 1997 Remastered",
+    " - 2011 Remastered Version",
+    " - 2011 Remaster",
+    " - 2009 Digital Remaster",
+    " - 2002 Remix",
+    " - 1987 Version",
+    " - Remastered 2011",
+    " - Version 2004",
+    " (2009 Remaster)",
+    " 2009 Remaster",
+    " (feat. X)",
+    " (Feat. Jay-Z & Beyoncé)",
+    " (feat. X) - Radio Edit",
+    ' - 12" Version',
+    ' - Special 12" Dance Mix',
+    " - (Original Single Mono Version)",
+    " - 7 inch",
+    " - Acoustic",
+    " - Edit",
+    " - Extended Version",
+    " - Full Length Version",
+    " - Instrumental Version",
+    " - Live",
+    " - Live at Wembley",
+    " - New Stereo Mix",
+    " - Original Album Version",
+    " - Original Mix",
+    " - Radio Edit",
+    " - Radio Version",
+    " - Re-mastered",
+    " - Remaster",
+    " - Remix",
+    " - Single Edit",
+    " - Single Mix",
+    " - Single Version",
+    " - Soundtrack Version",
+    " (Avicii Remix)",
+    " (Digitally Remastered)",
+    " (Live)",
+    " (Radio Edit)",
+    " (Single Version)",
+    " [Radio Edit]",
+    " Radio Edit",
+    " - Live - 2011 Remastered",
+    " (Live) - Remastered 2011",
+)
+# the old chain of replacements removed " - Remaster" before longer literals starting with it
+INTENDED_DIFFERENCES = {
+    " - Remastered": "Songed",
+    " - Remastered Version": "Songed Version",
+}
+
+
+def _clean_title_chain(title: str) -> str:
+    """Title cleanup from before it was fused into a single regex, kept as a reference."""
+    title = re.sub(r" \(?\d{4} Remaster\)?", "", title)
+    title = re.sub(r" - Remastered \d{4}", "", title)
+    title = re.sub(r" - Version \d{4}", "", title)
+    title = re.sub(r" - \d{4} Version", "", title)
+    title = re.sub(r" - \d{4} Remix", "", title)
+    title = re.sub(r" - \d{4} Digital Remaster", "", title)
+    title = re.sub(r" - \d{4} Remastered Version", "", title)
+    title = re.sub(r" \(feat\. [\w &,\.]+\)", "", title, flags=re.IGNORECASE)
+    title = re.sub(" -ed$", "", title)
+    return (
+        title.replace(' - 12" Version', "")
+        .replace(' - Special 12" Dance Mix', "")
+        .replace(" - (Original Single Mono Version)", "")
+        .replace(" - 7 inch", "")
+        .replace(" - Acoustic", "")
+        .replace(" - Edit", "")
+        .replace(" - Extended Version", "")
+        .replace(" - Full Length Version", "")
+        .replace(" - Instrumental Version", "")
+        .replace(" - Live", "")
+        .replace(" - New Stereo Mix", "")
+        .replace(" - Original Album Version", "")
+        .replace(" - Original Mix", "")
+        .replace(" - Radio Edit", "")
+        .replace(" - Radio Version", "")
+        .replace(" - Re-mastered", "")
+        .replace(" - Remaster", "")
+        .replace(" - Remastered Version", "")
+        .replace(" - Remastered", "")
+        .replace(" - Remix", "")
+        .replace(" - Single Edit", "")
+        .replace(" - Single Mix", "")
+        .replace(" - Single Version", "")
+        .replace(" - Soundtrack Version", "")
+        .replace(" -ed Version", "")
+        .replace(" (Avicii Remix)", "")
+        .replace(" (Digitally Remastered)", "")
+        .replace(" (Live)", "")
+        .replace(" (Radio Edit)", "")
+        .replace(" (Single Version)", "")
+        .replace(" [Radio Edit]", "")
+        .replace(" Radio Edit", "")
+        .strip()
+        .rstrip("-")
+        .rstrip()
+    )
+
+
+@pytest.mark.parametrize("suffix", TITLE_SUFFIXES)
+def test_clean_title_matches_old_chain(suffix: str) -> None:
+    title = "Song" + suffix
+    assert _clean_title(title) == _clean_title_chain(title)
+
+
+@pytest.mark.parametrize("suffix", INTENDED_DIFFERENCES)
+def test_clean_title_removes_whole_remastered_suffix(suffix: str) -> None:
+    title = "Song" + suffix
+    assert _clean_title_chain(title) == INTENDED_DIFFERENCES[suffix]
+    assert _clean_title(title) == "Song"
+
+
+@pytest.mark.parametrize("title", ["Yesterday", "Hey - Jude", "Let It Be (Reprise)", " Help! "])
+def test_clean_title_keeps_clean_titles(title: str) -> None:
+    assert _clean_title(title) == _clean_title_chain(title)
+
+
+class _FakeAuthManager:
+    def __init__(self) -> None:
+        self.tokens_issued = 0
+
+    def get_access_token(self, *, as_dict: bool) -> str:  # noqa: ARG002
+        self.tokens_issued += 1
+        return f"token{self.tokens_issued}"
+
+
+def test_liked_songs_pages_are_retried_after_temporary_errors(monkeypatch: pytest.MonkeyPatch) -> None:
+    requests_per_offset: dict[int, int] = {}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        offset = int(request.url.params["offset"])
+        requests_per_offset[offset] = requests_per_offset.get(offset, 0) + 1
+        first_try = requests_per_offset[offset] == 1
+        if offset == 0 and first_try:
+            return httpx.Response(httpx.codes.BAD_GATEWAY)
+        if offset == 50 and first_try:  # noqa: PLR2004
+            raise httpx.ConnectError("Connection reset by peer")
+        if offset == 100 and request.headers["Authorization"] == "Bearer token1":  # noqa: PLR2004
+            return httpx.Response(httpx.codes.UNAUTHORIZED)
+        track = {"name": f"Song {offset}", "artists": [{"name": "Artist"}]}
+        return httpx.Response(httpx.codes.OK, json={"items": [{"track": track}]})
+
+    async def no_sleep(_: float) -> None:
+        pass
+
+    async_client = httpx.AsyncClient
+    monkeypatch.setattr(spotify.asyncio, "sleep", no_sleep)
+    monkeypatch.setattr(
+        spotify.httpx,
+        "AsyncClient",
+        lambda **kwargs: async_client(transport=httpx.MockTransport(handler), headers=kwargs["headers"]),
+    )
+    auth_manager = _FakeAuthManager()
+    pages = asyncio.run(_get_all_liked_songs(auth_manager=auth_manager, total_songs=150))  # type: ignore  # noqa: PGH003
+
+    assert [song.title for page in pages for song in page] == ["Song 0", "Song 50", "Song 100"]
+    assert auth_manager.tokens_issued == 2  # noqa: PLR2004
@@ -0,0 +1,87 @@
+import asyncio
+import time
+from datetime import timedelta
+from http import HTTPStatus
+
+import httpx
+import pytest
+
+from scrapers import utils
+
+URL = "https://example.com/page"
+REQUESTS = 64
+REQUESTS_PER_SECOND = 100
+BURST = 5
+PAUSE_S = 0.5
+# margin for event loop scheduling
+MARGIN_S = 0.01
+
+
+async def _acquire_all(rate_limiter: utils.HostRateLimiter, n: int) -> list[float]:
+    """Acquire `n` slots concurrently and return times at which they were granted."""
+    granted_at: list[float] = []
+
+    async def acquire() -> None:
+        await rate_limiter.acquire(URL)
+        granted_at.append(time.monotonic())
+
+    async with asyncio.TaskGroup() as task_group:
+        for _ in range(n):
+            task_group.create_task(acquire())
+    return granted_at
+
+
+def test_pause_holds_back_requests_already_waiting_for_their_slot() -> None:
+    async def run() -> tuple[float, list[float]]:
+        rate_limiter = utils.HostRateLimiter(requests_per_second=REQUESTS_PER_SECOND, burst=BURST)
+        acquire_all = asyncio.create_task(_acquire_all(rate_limiter, REQUESTS))
+        await asyncio.sleep(0.1)
+        paused_at = time.monotonic()
+        rate_limiter.pause(URL, timedelta(seconds=PAUSE_S))
+        return paused_at, await acquire_all
+
+    paused_at, granted_at = asyncio.run(run())
+    resume_at = paused_at + PAUSE_S
+    assert len(granted_at) == REQUESTS
+    assert not [t for t in granted_at if paused_at + MARGIN_S < t < resume_at - MARGIN_S]
+    # requests that were held back are still spread out by the rate limit after the pause
+    after_pause = sorted(t for t in granted_at if t >= resume_at - MARGIN_S)
+    min_duration = (len(after_pause) - BURST) / REQUESTS_PER_SECOND
+    assert after_pause[-1] - after_pause[0] >= min_duration - 2 * MARGIN_S
+
+
+@pytest.mark.parametrize(
+    ("status_code", "headers", "expected_tries"),
+    [
+        (429, {}, 2),
+        (503, {"Retry-After": "1"}, 2),
+        (503, {}, 1),
+        (500, {"Retry-After": "1"}, 1),
+    ],
+)
+def test_http_get_async_waits_when_server_asks_to(
+    monkeypatch: pytest.MonkeyPatch,
+    status_code: int,
+    headers: dict[str, str],
+    expected_tries: int,
+) -> None:
+    sleeps: list[float] = []
+
+    async def fake_sleep(seconds: float) -> None:
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(utils, "async_sleep", fake_sleep)
+    responses = iter((httpx.Response(status_code, headers=headers), httpx.Response(HTTPStatus.OK)))
+    transport = httpx.MockTransport(lambda _: next(responses))
+
+    async def run() -> httpx.Response:
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await utils.http_get_async(client=client, url=URL)
+
+    if expected_tries == 1:
+        with pytest.raises(httpx.HTTPStatusError):
+            asyncio.run(run())
+        assert sleeps == []
+    else:
+        assert asyncio.run(run()).status_code == HTTPStatus.OK
+        assert sleeps == [timedelta(seconds=30).total_seconds()]
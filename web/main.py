@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 
+from pyodide.ffi import create_once_callable  # type: ignore
 from pyscript import document, window, workers  # type: ignore
 
 
@@ -15,17 +16,17 @@ class ButtonManager:
         self.element_id = element_id
         self.html_element = document.getElementById(self.element_id)
         self.disabled = disabled
-        if self.disabled:
-            self.html_element.setAttribute("disabled", "")
+        # disabled property is set directly instead of adding/removing the attribute
+        self.html_element.disabled = self.disabled
 
     def disable(self) -> None:
         if not self.disabled:
-            self.html_element.setAttribute("disabled", "")
+            self.html_element.disabled = True
             self.disabled = True
 
     def enable(self) -> None:
         if self.disabled:
-            self.html_element.removeAttribute("disabled")
+            self.html_element.disabled = False
             self.disabled = False
 
     def __enter__(self) -> None:
@@ -40,12 +41,17 @@ class TableManager:
         self.element_id = element_id
         self.element = document.getElementById(self.element_id)
 
+    def set_html(self, html: str) -> None:
+        # the browser applies the change together with the next repaint instead of doing layout right away,
+        # callbacks run in the order they were scheduled so the last html set is the one that stays
+        window.requestAnimationFrame(create_once_callable(lambda _: setattr(self.element, "innerHTML", html)))
+
     def set_loading_state(self) -> None:
-        self.element.innerHTML = """
+        self.set_html("""
             <div class="loading-table">
                 <h1>Loading results</h1>
             </div>
-        """
+        """)
 
     def __enter__(self) -> None:
         self.set_loading_state()
@@ -55,13 +61,13 @@ class TableManager:
             window.console.log(exc_type, exc_value, traceback)
             # it seems that when exception is raised in the worker this part is not run but I'll leave the code here
             # in case I ever get around to investigating if it can be made to work
-            self.element.innerHTML = f"""
+            self.set_html(f"""
                 <div>
                     Exception {exc_type} {exc_value}
                     <br>
                     {traceback}
                 </div>
-            """
+            """)
 
 
 class Settings:
@@ -93,6 +99,10 @@ search_button_manager = ButtonManager(element_id="button-search", disabled=False
 loading_database_modal = document.getElementById("loading-database")
 
 
+# inputs
+search_input = document.getElementById("search-input")
+
+
 # table objects
 table_shuffle_results = TableManager("div-results")
 table_search_results = TableManager("div-results-search")
@@ -116,29 +126,29 @@ async def ui_new_shuffle(*args, **kwargs) -> None:
             modifiers.ug_url_modifier,
             modifiers.wywrota_url_modifier,
         )
-        table_shuffle_results.element.innerHTML = table
+        table_shuffle_results.set_html(table)
 
 
 async def ui_load_previous_songs(*args, **kwargs) -> None:
     with shuffle_button_manager, back_button_manager, table_shuffle_results:
         how_many_previous_available, table = await backend_worker.load_previous_songs()
-        table_shuffle_results.element.innerHTML = table
+        table_shuffle_results.set_html(table)
     if how_many_previous_available == 0:
         back_button_manager.disable()
 
 
 async def ui_new_search(*args, **kwargs) -> None:
-    search_term = str(document.getElementById("search-input").value).replace(" - ", " ").strip()
+    search_term = str(search_input.value).replace(" - ", " ").strip()
     with search_button_manager, table_search_results:
         result = await backend_worker.new_search(search_term)
-        table_search_results.element.innerHTML = result
+        table_search_results.set_html(result)
 
 
 async def ui_new_search_on_keypress(event) -> None:
     if event.key == "Enter":
         await ui_new_search()
     elif event.key == "Escape":
-        document.getElementById("search-input").value = ""
+        search_input.value = ""
 
 
 # initialize
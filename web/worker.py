@@ -1,35 +1,57 @@
 import time
-from collections.abc import Generator, Iterable
-from dataclasses import astuple, dataclass
+import unicodedata
+from collections import Counter, deque
+from collections.abc import Iterable
+from dataclasses import dataclass
 from datetime import timedelta
 
 import duckdb
 from pyscript import window  # type: ignore
-from tabulate import tabulate
+
+# one row per chord link: artist, title and the already rendered HTML table row
+SongRow = tuple[str, str, str]
+# turns selected songs (with `score` to sort by) into one HTML table row per chord link,
+# artist and title are only shown in the first row of each song and numbers are aligned to the right
+FLATTEN_SONGS_QUERY = """
+    SELECT
+        artist,
+        title,
+        concat(
+            '<tr>',
+            '<td>', CASE chord_idx WHEN 1 THEN artist ELSE '' END, '</td>',
+            '<td>', CASE chord_idx WHEN 1 THEN title ELSE '' END, '</td>',
+            '<td style="text-align: right;">', format('{:,}', chord.version), '</td>',
+            '<td><a href="', chord.url, '" target="_blank">',
+            -- one regex match on the host instead of checking it for every site
+            CASE regexp_extract(chord.url, '^[a-z]+://[^/]*(wywrota|ultimate-guitar)', 1)
+                WHEN 'wywrota' THEN '<img src="./wywrota-icon.png" alt="(W)" width="16" height="16"/>'
+                WHEN 'ultimate-guitar' THEN '<img src="./ug-icon.ico" alt="(UG)" width="16" height="16"/>'
+                ELSE '🔗'
+            END,
+            ' Link ↗️</a></td>',
+            '<td style="text-align: right;">', format('{:.2f}', chord.rating), '</td>',
+            '<td style="text-align: right;">', format('{:,}', chord.votes), '</td>',
+            '<td>', chord.difficulty, '</td>',
+            '<td>', chord.tonality_name, '</td>',
+            '<td>', CASE liked_on_spotify WHEN true THEN '❤️' ELSE '' END, '</td>',
+            '</tr>\n'
+        ) html_row
+    FROM (SELECT *, unnest(chords) AS chord, generate_subscripts(chords, 1) AS chord_idx FROM songs)
+    ORDER BY score DESC, artist, title, chord_idx
+"""
+TABLE_HEAD = """<table>
+<thead>
+<tr><th>Artist</th><th>Title</th><th style="text-align: right;">Version</th><th>URL</th><th style="text-align: right;">Rating</th><th style="text-align: right;">Votes</th><th>Difficulty</th><th>Tonality</th><th>Liked on Spotify</th></tr>
+</thead>
+<tbody>
+"""  # noqa: E501
+TABLE_TAIL = "</tbody>\n</table>"
 
 # Global variables to be initialized later
 data: "DataStore" = None  # type: ignore
 table: "SongTable" = None  # type: ignore
 
 
-@dataclass(frozen=True, slots=True)
-class Chord:
-    version: int
-    url: str
-    rating: float | None
-    votes: int | None
-    difficulty: str | None
-    tonality_name: str | None
-
-
-@dataclass(frozen=True, slots=True)
-class Song:
-    artist: str
-    title: str
-    chords: list[Chord]
-    liked_on_spotify: bool
-
-
 @dataclass(frozen=True, slots=True)
 class Stats:
     number_of_songs: int
@@ -44,6 +66,12 @@ class Modifiers:
     wywrota_url_modifier: float
 
 
+def _normalize_search_term(search_term: str) -> str:
+    """Python equivalent of DuckDB's strip_accents(lower(...)) used for search columns."""
+    decomposed = unicodedata.normalize("NFD", search_term.lower())
+    return unicodedata.normalize("NFC", "".join(c for c in decomposed if not unicodedata.category(c).startswith("M")))
+
+
 class DataStore:
     def __init__(self) -> None:
         window.console.log("Initializing database...")
@@ -52,6 +80,7 @@ class DataStore:
             PRAGMA disable_print_progress_bar;
             PRAGMA disable_progress_bar;
             SET preserve_insertion_order = false;
+            SET threads = 1;
         """)
         self.conn.execute("""
             CREATE TABLE chords AS
@@ -62,68 +91,88 @@ class DataStore:
                 strip_accents(lower(concat(artist, ' ', title))) as search_col_at
             FROM 'chords.parquet'
         """)
-        self.conn.execute("CREATE TABLE previous_songs (artist TEXT NOT NULL, title TEXT NOT NULL)")
         self.conn.execute("ANALYZE")
+        # everything is in memory from now on, no query should touch files or network
+        self.conn.execute("SET enable_external_access = false")
+        # chords lists are the bulk of the data, they are only looked up for the 10 selected songs
         self.get_songs_query = """
             WITH
             sample AS (
                 SELECT
+                    rowid,
                     artist,
                     title,
-                    chords,
                     liked_on_spotify,
                     has_ug_tabs,
                     has_wywrota_tabs
                 FROM chords TABLESAMPLE BERNOULLI(2%)
+            ),
+            selected AS (
+                SELECT
+                    rowid,
+                    -- flags are never null and are either 0 or 1 so modifiers can simply be multiplied by them
+                    (
+                        random()
+                        + liked_on_spotify::INT * ?
+                        + has_ug_tabs * ?
+                        + has_wywrota_tabs * ?
+                    ) score
+                FROM sample
+                ANTI JOIN (
+                    SELECT unnest(?::VARCHAR[]) artist, unnest(?::VARCHAR[]) title
+                ) previous_songs USING(artist, title)
+                ORDER BY score desc
+                LIMIT 10
+            ),
+            songs AS (
+                SELECT
+                    chords.artist,
+                    chords.title,
+                    chords.chords,
+                    chords.liked_on_spotify,
+                    selected.score
+                FROM selected
+                JOIN chords ON chords.rowid = selected.rowid
             )
-            SELECT
-                artist,
-                title,
-                chords,
-                CASE liked_on_spotify WHEN true THEN '❤️' ELSE '' END liked_on_spotify
-            FROM sample
-            ANTI JOIN previous_songs USING(artist, title)
-            ORDER BY (
-                random()
-                + CASE liked_on_spotify WHEN true THEN ? ELSE 0 END
-                + CASE has_ug_tabs WHEN 1 THEN ? ELSE 0 END
-                + CASE has_wywrota_tabs WHEN 1 THEN ? ELSE 0 END
-            ) desc
-            LIMIT 10
-        """
+        """ + FLATTEN_SONGS_QUERY  # noqa: S608
+        # search term is normalized in python the same way as search columns, see _normalize_search_term
         self.search_songs_query_exact_match = """
             WITH
-            params as (SELECT strip_accents(lower(?)) as search_term)
-            SELECT
-                artist,
-                title,
-                chords,
-                CASE liked_on_spotify WHEN true THEN '❤️' ELSE '' END liked_on_spotify
-            FROM chords
-            WHERE
-                search_col_a = (select search_term from params)
-                or search_col_t = (select search_term from params)
-        """
+            songs AS (
+                SELECT
+                    artist,
+                    title,
+                    chords,
+                    liked_on_spotify,
+                    0 score
+                FROM chords
+                WHERE
+                    search_col_a = $search_term
+                    or search_col_t = $search_term
+            )
+        """ + FLATTEN_SONGS_QUERY
         self.search_songs_query = """
             WITH
-            params as (SELECT strip_accents(lower(?)) as search_term)
-            SELECT
-                artist,
-                title,
-                chords,
-                CASE liked_on_spotify WHEN true THEN '❤️' ELSE '' END liked_on_spotify
-            FROM chords
-            WHERE
-                search_col_at LIKE concat('%', replace((select search_term from params), ' ', '%'), '%')
-                or search_col_a LIKE concat((select search_term from params), '%')
-                or search_col_t LIKE concat((select search_term from params), '%')
-            ORDER BY greatest(
-                jaro_similarity(search_col_at, (select search_term from params)), -- 1.0 is exact match, 0.0 is no match
-                jaro_similarity(search_col_a, (select search_term from params)),
-                jaro_similarity(search_col_t, (select search_term from params))
-            ) desc
-            LIMIT 10
-        """
+            songs AS (
+                SELECT
+                    artist,
+                    title,
+                    chords,
+                    liked_on_spotify,
+                    greatest(
+                        jaro_similarity(search_col_at, $search_term), -- 1.0 is exact match
+                        jaro_similarity(search_col_a, $search_term),
+                        jaro_similarity(search_col_t, $search_term)
+                    ) score
+                FROM chords
+                WHERE
+                    search_col_at LIKE concat('%', replace($search_term, ' ', '%'), '%')
+                    or search_col_a LIKE concat($search_term, '%')
+                    or search_col_t LIKE concat($search_term, '%')
+                ORDER BY score desc
+                LIMIT 10
+            )
+        """ + FLATTEN_SONGS_QUERY
         window.console.log("Finished initializing database.")
 
     def get_stats(self) -> Stats:
@@ -145,24 +194,21 @@ class DataStore:
             wywrota_tabs=wywrota_tabs,
         )
 
-    def search_songs(self, search_term: str) -> list[Song]:
+    def search_songs(self, search_term: str) -> list[SongRow]:
         start_time = time.perf_counter()
-        self.conn.execute(self.search_songs_query_exact_match, [search_term])
+        parameters = {"search_term": _normalize_search_term(search_term)}
+        self.conn.execute(self.search_songs_query_exact_match, parameters)
         data = self.conn.fetchall()
         if len(data) == 0:
             search_type = "fuzzy"
-            self.conn.execute(self.search_songs_query, [search_term])
+            self.conn.execute(self.search_songs_query, parameters)
             data = self.conn.fetchall()
         else:
             search_type = "exact"
         end_time = time.perf_counter()
         delta = timedelta(seconds=(end_time - start_time))
         window.console.log(f"Searching songs for term: {search_term} in database took {delta}. Search type: {search_type}")  # noqa: E501
-        songs = [
-            Song(artist=row[0], title=row[1], chords=[Chord(**chord) for chord in row[2]], liked_on_spotify=row[3])
-            for row in data
-        ]
-        return songs
+        return data
 
     def get_songs(
         self,
@@ -170,14 +216,14 @@ class DataStore:
         ug_url_modifier: float = 0.0,
         wywrota_url_modifier: float = 0.0,
         previous_songs: Iterable[tuple[str, str]] | None = None,
-    ) -> list[Song]:
+    ) -> list[SongRow]:
         """Gets a batch of random songs from the database, applying given modifiers and excluding previous songs."""
-        start_time = time.perf_counter()
-        if previous_songs:
-            self.conn.execute("TRUNCATE previous_songs")
-            self.conn.executemany("INSERT INTO previous_songs VALUES (?, ?)", previous_songs)
-        delta = timedelta(seconds=(time.perf_counter() - start_time))
-        window.console.log(f"Inserting previous songs into the database took {delta}")
+        # previous songs are passed as two lists bound to the query instead of being written to a table on every call
+        previous_artists = []
+        previous_titles = []
+        for artist, title in previous_songs or ():
+            previous_artists.append(artist)
+            previous_titles.append(title)
         window.console.log(f"Sending get_songs query with modifiers: liked_songs_modifier={liked_songs_modifier}, ug_url_modifier={ug_url_modifier}, wywrota_url_modifier={wywrota_url_modifier}")  # noqa: E501
         start_time = time.perf_counter()
         self.conn.execute(
@@ -186,85 +232,62 @@ class DataStore:
                 liked_songs_modifier,
                 ug_url_modifier,
                 wywrota_url_modifier,
+                previous_artists,
+                previous_titles,
             ],
         )
         window.console.log("Executed get_songs_query")
         data = self.conn.fetchall()
         delta = timedelta(seconds=(time.perf_counter() - start_time))
         window.console.log(f"Getting a batch of random songs from database took {delta}")
-        songs = [
-            Song(artist=row[0], title=row[1], chords=[Chord(**chord) for chord in row[2]], liked_on_spotify=row[3])
-            for row in data
-        ]
-        return songs
+        return data
+
+
+def _songs(rows: list[SongRow]) -> set[tuple[str, str]]:
+    return {row[:2] for row in rows}
 
 
 class SongTable:
     def __init__(self, history_size: int = 10) -> None:
-        self.columns = [
-            "Artist",
-            "Title",
-            "Version",
-            "URL",
-            "Rating",
-            "Votes",
-            "Difficulty",
-            "Tonality",
-            "Liked on Spotify",
-        ]
-        self.data: list[Song] = []
-        self.previous_data: list[list[Song]] = []
-        self.previous_data_limit = history_size
-
-    def _flat_data(self) -> Generator[tuple, None, None]:
-        for song in self.data:
-            for idx, chord in enumerate(song.chords):
-                if idx == 0:
-                    yield (song.artist, song.title, *astuple(chord), song.liked_on_spotify)
-                else:
-                    yield ("", "", *astuple(chord), song.liked_on_spotify)
-
-    @staticmethod
-    def _site_symbol(url: str) -> str:
-        if "wywrota" in url:
-            return '<img src="./wywrota-icon.png" alt="(W)" width="16" height="16"/>'
-        if "ultimate-guitar" in url:
-            return '<img src="./ug-icon.ico" alt="(UG)" width="16" height="16"/>'
-        return "🔗"
+        self.data: list[SongRow] = []
+        self.html_table = ""
+        # history of (data, its html table) so going back does not need to render the table again
+        self.previous_data: deque[tuple[list[SongRow], str]] = deque(maxlen=history_size)
+        # (artist, title) of songs in previous_data with number of entries they appear in, kept up to date on changes
+        self.previous_songs: Counter[tuple[str, str]] = Counter()
 
     def _data_as_html_table(self) -> str:
         start_time = time.perf_counter()
         if len(self.data) == 0:
             return ""
-        url_col_idx = self.columns.index("URL")
-        data_with_urls_as_links = (
-            t[:url_col_idx]
-            + (f'<a href="{t[url_col_idx]}" target="_blank">{self._site_symbol(t[url_col_idx])} Link ↗️</a>',)
-            + t[url_col_idx + 1 :]
-            for t in self._flat_data()
-        )
-        table = tabulate(
-            tabular_data=data_with_urls_as_links,
-            headers=self.columns,
-            tablefmt="unsafehtml",
-            showindex=False,
-            floatfmt=".2f",
-            intfmt=",",
-        )
+        # rows are rendered by the database, only the table around them is added here
+        table = "".join((TABLE_HEAD, *(row[2] for row in self.data), TABLE_TAIL))
         end_time = time.perf_counter()
         delta = timedelta(seconds=(end_time - start_time))
         window.console.log(f"Creating HTML table took {delta}")
         return table
 
-    def set_data(self, data: list[Song]) -> str:
+    def _forget_previous_songs(self, entry: list[SongRow]) -> None:
+        for song in _songs(entry):
+            count = self.previous_songs[song] - 1
+            if count > 0:
+                self.previous_songs[song] = count
+            else:
+                del self.previous_songs[song]
+
+    def set_data(self, data: list[SongRow]) -> str:
         """
         Sets new data, saves current data to previous_data history, and returns HTML table representation of new data.
         """
-        if len(self.previous_data) >= self.previous_data_limit:
-            self.previous_data.pop(0)
-        self.previous_data.append(self.data)
+        if len(self.previous_data) == self.previous_data.maxlen:
+            # deque would drop the oldest entry on its own but its songs have to be forgotten as well
+            oldest_data, _ = self.previous_data.popleft()
+            self._forget_previous_songs(oldest_data)
+        self.previous_data.append((self.data, self.html_table))
+        self.previous_songs.update(_songs(self.data))
         self.data = data
-        return self._data_as_html_table()
+        self.html_table = self._data_as_html_table()
+        return self.html_table
 
     def load_previous(self) -> tuple[int, str]:
         """Loads previous data from history and returns tuple of:
@@ -272,8 +295,9 @@ class SongTable:
         """
         if not self.previous_data:
             raise ValueError("No previous data to show")
-        self.data = self.previous_data.pop()
-        return len(self.previous_data), self._data_as_html_table()
+        self.data, self.html_table = self.previous_data.pop()
+        self._forget_previous_songs(self.data)
+        return len(self.previous_data), self.html_table
 
 
 def init_data_store_and_table(history_size: int = 10) -> None:
@@ -285,7 +309,8 @@ def init_data_store_and_table(history_size: int = 10) -> None:
 
 def get_stats() -> tuple[int, int, int]:
     """Gets number of songs in the database."""
-    return astuple(data.get_stats())
+    stats = data.get_stats()
+    return stats.number_of_songs, stats.ug_tabs, stats.wywrota_tabs
 
 
 def new_shuffle(
@@ -296,12 +321,11 @@ def new_shuffle(
     **kwargs,
 ) -> str:
     """Generates a new batch of random songs applying given modifiers and returns HTML table representation of the table."""  # noqa: E501
-    previous_songs = {(song.artist, song.title) for entry in table.previous_data for song in entry}
     songs = data.get_songs(
         liked_songs_modifier=liked_songs_modifier,
         ug_url_modifier=ug_url_modifier,
         wywrota_url_modifier=wywrota_url_modifier,
-        previous_songs=previous_songs,
+        previous_songs=table.previous_songs,
     )
     html_table = table.set_data(songs)
     return html_table